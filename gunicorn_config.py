@@ -1,51 +1,104 @@
 # gunicorn_config.py - Configuration pour main.py
 import os
-import multiprocessing
+import sys
+import fcntl
+import math
+import threading
+
+# Pas de fichiers .pyc écrits par chaque worker (la variable d'environnement
+# ne serait lue qu'au lancement d'un nouvel interpréteur)
+sys.dont_write_bytecode = True
+
+# Chargés dans le master, avant le fork, pour que les workers partagent ces
+# pages mémoire ; post_fork se contente de lancer les threads
+from logging_config import start_log_listener
+from main import BOT_LOCK_FILE, RUN_BOT_IN_WEB, start_telegram_bot_thread
+
+
+def effective_cpu_count():
+    """Nombre de CPU réellement alloués au conteneur (quota cgroup, sinon affinité)"""
+    # cgroup v2 : "<quota> <période>" ou "max <période>"
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1.0, int(quota) / int(period))
+    except (OSError, ValueError):
+        pass
+
+    # cgroup v1 : quota à -1 quand il n'y a pas de limite
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1.0, quota / period)
+    except (OSError, ValueError):
+        pass
+
+    # Sans quota : CPU visibles par le processus (respecte taskset)
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
 
 # Configuration du serveur
 bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
-workers = 1
-worker_class = "sync"
-worker_connections = 1000
+def default_workers():
+    """Un seul worker jusqu'à 1 CPU (chaque worker charge Flask et la pile Telegram),
+    sinon min(4, 2 * CPU + 1)"""
+    cpus = effective_cpu_count()
+    return 1 if cpus <= 1 else min(4, 2 * math.ceil(cpus) + 1)
+
+workers = int(os.getenv("WEB_CONCURRENCY", default_workers()))
+# gthread par défaut : le bot tourne dans un vrai thread avec sa propre boucle
+# asyncio, que le monkey-patching de gevent transformerait en greenlet bloquant
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = 5
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
 max_requests = 1000
 max_requests_jitter = 100
 preload_app = True
 timeout = 120
-keepalive = 2
+graceful_timeout = 30
+# Les sondes réutilisent leurs connexions ~30 s : sans coût pour gthread/gevent,
+# mais un worker sync resterait bloqué sur chaque connexion inactive
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "30")) if worker_class != "sync" else 2
+
+# SO_REUSEPORT n'existe que sous Linux (noyau >= 3.9)
+if sys.platform.startswith("linux"):
+    reuse_port = True
 
 # Logging
 loglevel = "info"
 accesslog = "-"  # stdout
+logger_class = "gunicorn_logging.QuietLogger"  # sans /health ni /ping
 errorlog = "-"   # stderr
-access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s" %(D)s'
+access_log_format = '%(h)s %(t)s "%(r)s" %(s)s %(b)s'
 
 # Processus
 daemon = False
 pidfile = None
 tmp_upload_dir = None
+# Fichier de heartbeat des workers en mémoire (tmpfs) plutôt que sur disque
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
 
-# Sécurité
-limit_request_line = 4096
-limit_request_fields = 100
-limit_request_field_size = 8190
+# Sécurité : les sondes légitimes envoient quelques en-têtes courts,
+# le parseur rejette plus tôt les requêtes de scanners
+limit_request_line = 2048
+limit_request_fields = 32
+limit_request_field_size = 2048
 
-# === Flag global pour éviter plusieurs bots ===
-_bot_started = False
+# === Verrou pour qu'un seul worker fasse tourner le bot (BOT_LOCK_FILE, sondé
+# aussi par /health depuis les autres workers) ===
+_bot_lock = None
 
-def post_fork(server, worker):
-    """Démarre le bot Telegram dans un seul worker"""
-    global _bot_started
-    server.log.info(f"Worker {worker.pid} démarré")
-
-    if not _bot_started:
-        server.log.info("🚀 Lancement du bot Telegram dans ce worker")
-        bot_thread = threading.Thread(target=run_telegram_bot, daemon=True)
-        bot_thread.start()
-        _bot_started = True
-        
 # Worker lifecycle
 def on_starting(server):
     server.log.info("Démarrage de Gunicorn")
+    if server.cfg.worker_class_str == "sync" and server.cfg.keepalive > 5:
+        server.log.warning(f"keepalive={server.cfg.keepalive}s avec des workers sync : chaque connexion inactive bloque un worker")
 
 def on_reload(server):
     server.log.info("Rechargement de Gunicorn")
@@ -55,12 +108,38 @@ def worker_int(worker):
 
 def pre_fork(server, worker):
     server.log.info(f"Worker {worker.pid} sur le point de démarrer")
+
 def post_fork(server, worker):
+    """Démarre le bot Telegram dans le seul worker qui obtient le verrou"""
     server.log.info(f"Worker {worker.pid} démarré")
+
+    # Le thread d'écriture des logs du master ne survit pas au fork
+    start_log_listener()
+
+    if not RUN_BOT_IN_WEB:
+        server.log.info("RUN_BOT_IN_WEB=0 : le bot tourne dans un service séparé")
+        return
+
+    # Chaque worker attend le verrou dans un thread : quand le worker qui fait
+    # tourner le bot meurt (recyclage, HUP, déploiement qui se chevauche),
+    # un worker encore en vie prend le relais
+    threading.Thread(target=_wait_for_bot_lock, args=(server, worker), daemon=True).start()
+
+def _wait_for_bot_lock(server, worker):
+    """Bloque jusqu'à obtenir le verrou, puis démarre le bot dans ce worker"""
+    global _bot_lock
+    lock = open(BOT_LOCK_FILE, "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        server.log.info(f"Bot Telegram déjà actif dans un autre worker, {worker.pid} attend le verrou")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+    # Le verrou reste tenu tant que le worker vit, il est libéré à sa mort
+    _bot_lock = lock
+
     try:
-        from main import start_telegram_bot_thread
         start_telegram_bot_thread()
-        server.log.info("Bot Telegram lancé dans post_fork")
+        server.log.info(f"Bot Telegram lancé dans le worker {worker.pid}")
     except Exception as e:
         server.log.error(f"Impossible de démarrer le bot : {e}")
 
@@ -0,0 +1,14 @@
+# gunicorn_logging.py - Logger gunicorn sans les lignes d'accès des sondes
+from gunicorn.glogging import Logger
+
+# Endpoints appelés en boucle par Render et UptimeRobot
+QUIET_PATHS = frozenset({'/health', '/ping'})
+
+
+class QuietLogger(Logger):
+    """Logger gunicorn qui n'écrit pas de ligne d'accès pour les sondes de santé"""
+
+    def access(self, resp, req, environ, request_time):
+        if environ.get('PATH_INFO') in QUIET_PATHS:
+            return
+        super().access(resp, req, environ, request_time)
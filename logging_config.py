@@ -1,16 +1,77 @@
 import os
+import atexit
+import queue
 import logging
 import logging.config
+from logging.handlers import QueueHandler, QueueListener
 
 # Réduire le niveau de log pour httpx
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
-# Assurer que le répertoire logs existe
-os.makedirs('logs', exist_ok=True)
+# Logger interne qui porte les handlers fichiers le temps de la configuration
+FILE_SINK_LOGGER = 'logging_config.files'
+
+# Les écritures disque sont faites par un thread dédié : les appels de log
+# ne font que déposer l'enregistrement dans cette file
+_log_queue = queue.Queue(-1)
+_queue_handler = None
+_file_handlers = []
+_listener = None
+_listener_pid = None
+
+def running_in_container():
+    """Render, Heroku et Kubernetes collectent déjà stdout/stderr"""
+    return bool(os.getenv('RENDER') or os.getenv('DYNO') or os.getenv('KUBERNETES_SERVICE_HOST'))
+
+def _file_handler_configs(debug_enabled):
+    """Handlers fichiers (alimentés par la file d'attente) pour dictConfig"""
+    handlers = {
+        'queue_handler': {
+            '()': 'logging.handlers.QueueHandler',
+            'queue': _log_queue,
+        },
+        'info_file_handler': {
+            'class': 'logging.handlers.WatchedFileHandler',
+            'level': 'INFO',
+            'formatter': 'standard',
+            'filename': 'logs/info.log',
+            'encoding': 'utf8',
+        },
+        'error_file_handler': {
+            'class': 'logging.handlers.WatchedFileHandler',
+            'level': 'ERROR',
+            'formatter': 'detailed',
+            'filename': 'logs/errors.log',
+            'encoding': 'utf8',
+        },
+    }
+
+    # Le fichier debug.log n'est alimenté que si LOG_DEBUG=1
+    if debug_enabled:
+        handlers['debug_file_handler'] = {
+            'class': 'logging.handlers.WatchedFileHandler',
+            'level': 'DEBUG',
+            'formatter': 'detailed',
+            'filename': 'logs/debug.log',
+            'encoding': 'utf8',
+        }
+    return handlers
 
 def configure_logging():
-    """Configure le système de logging avec rotation des fichiers"""
-    
+    """Configure le système de logging (rotation des fichiers assurée par logrotate)"""
+    global _queue_handler
+    stop_log_listener()
+
+    # Sans LOG_DEBUG=1 le root reste en INFO et logger.debug() s'arrête au
+    # test isEnabledFor
+    debug_enabled = os.getenv('LOG_DEBUG') == '1'
+
+    # En conteneur les fichiers de logs feraient doublon avec stdout et
+    # disparaissent au redémarrage : tout passe par la console
+    file_logging = not running_in_container()
+    root_handlers = ['console', 'queue_handler'] if file_logging else ['console']
+    library_handlers = ['queue_handler'] if file_logging else ['console']
+
     logging_config = {
         'version': 1,
         'disable_existing_loggers': False,
@@ -32,56 +93,82 @@ def configure_logging():
                 'formatter': 'simple',
                 'stream': 'ext://sys.stdout',
             },
-            'info_file_handler': {
-                'class': 'logging.handlers.RotatingFileHandler',
-                'level': 'INFO',
-                'formatter': 'standard',
-                'filename': 'logs/info.log',
-                'maxBytes': 10485760,  # 10MB
-                'backupCount': 10,
-                'encoding': 'utf8',
-            },
-            'error_file_handler': {
-                'class': 'logging.handlers.RotatingFileHandler',
-                'level': 'ERROR',
-                'formatter': 'detailed',
-                'filename': 'logs/errors.log',
-                'maxBytes': 10485760,  # 10MB
-                'backupCount': 20,
-                'encoding': 'utf8',
-            },
-            'debug_file_handler': {
-                'class': 'logging.handlers.RotatingFileHandler',
-                'level': 'DEBUG',
-                'formatter': 'detailed',
-                'filename': 'logs/debug.log',
-                'maxBytes': 10485760,  # 10MB
-                'backupCount': 5,
-                'encoding': 'utf8',
-            }
         },
         'loggers': {
             '': {  # root logger
-                'handlers': ['console', 'info_file_handler', 'error_file_handler', 'debug_file_handler'],
-                'level': 'INFO',
+                'handlers': root_handlers,
+                'level': 'DEBUG' if debug_enabled else 'INFO',
                 'propagate': True
             },
             'telegram': {
-                'handlers': ['info_file_handler', 'error_file_handler'],
+                'handlers': library_handlers,
                 'level': 'INFO',
                 'propagate': False
             },
             'httpx': {  # Pour réduire les logs verbeux de certaines librairies
-                'handlers': ['error_file_handler'],
+                'handlers': library_handlers,
+                'level': 'WARNING',
+                'propagate': False
+            },
+            'apscheduler': {  # Le job_queue logue chaque suppression différée
+                'handlers': library_handlers,
                 'level': 'WARNING',
                 'propagate': False
             },
         }
     }
+
+    if file_logging:
+        # Assurer que le répertoire logs existe
+        os.makedirs('logs', exist_ok=True)
+        file_configs = _file_handler_configs(debug_enabled)
+        logging_config['handlers'].update(file_configs)
+        logging_config['loggers'][FILE_SINK_LOGGER] = {
+            'handlers': [name for name in file_configs if name != 'queue_handler'],
+            'propagate': False
+        }
     
     logging.config.dictConfig(logging_config)
+
+    if not file_logging:
+        _queue_handler = None
+        _file_handlers.clear()
+        return logging.getLogger(__name__)
+
+    # Les handlers fichiers sont confiés au QueueListener
+    _queue_handler = next(h for h in logging.getLogger().handlers if isinstance(h, QueueHandler))
+    file_sink = logging.getLogger(FILE_SINK_LOGGER)
+    _file_handlers[:] = file_sink.handlers
+    for handler in _file_handlers:
+        file_sink.removeHandler(handler)
+
+    start_log_listener()
     return logging.getLogger(__name__)
 
+def start_log_listener():
+    """Démarre le thread d'écriture des fichiers de log (à rappeler après un fork)"""
+    global _listener, _listener_pid
+    if not _file_handlers or _listener_pid == os.getpid():
+        return
+
+    if _listener_pid is not None:
+        # Après un fork, la file héritée contient des enregistrements que le
+        # parent écrira lui-même
+        _queue_handler.queue = queue.Queue(-1)
+
+    _listener = QueueListener(_queue_handler.queue, *_file_handlers, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+
+def stop_log_listener():
+    """Vide la file d'attente et arrête le thread d'écriture des logs"""
+    global _listener_pid
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        _listener_pid = None
+
+atexit.register(stop_log_listener)
+
 # Fonction pour obtenir un logger configuré
 def get_logger(name):
     return logging.getLogger(name)
\ No newline at end of file
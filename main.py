@@ -1,22 +1,47 @@
 import os
 from dotenv import load_dotenv
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, Message, InputMediaPhoto, ChatPermissions
-from telegram.ext import Application, CommandHandler, ContextTypes, ChatMemberHandler, filters, MessageHandler
+from telegram.request import HTTPXRequest
+from telegram.ext import AIORateLimiter, Application, ContextTypes, ChatMemberHandler, filters, MessageHandler
 from telegram.constants import ChatMemberStatus, ParseMode
-from telegram.error import BadRequest, Forbidden
+from telegram.error import BadRequest, Forbidden, TelegramError
 
 from collections import defaultdict
-from flask import Flask, jsonify
+from cachetools import TTLCache
+from flask import Flask, request
+from werkzeug.exceptions import HTTPException
+from hypercorn.asyncio import serve as hypercorn_serve
+from hypercorn.config import Config as HypercornConfig
 import asyncio
+import fcntl
+import functools
+import html
+import json
+import logging
+import time
 from logging_config import configure_logging, get_logger
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time as dt_time
+from zoneinfo import ZoneInfo
 import yaml
-import pytz
 import re
 import signal
 import sys
 import threading
 
+try:
+    import orjson
+except ImportError:  # orjson est optionnel : json de la stdlib sinon
+    orjson = None
+
+# Parseur YAML en C (libyaml) quand PyYAML a été compilé avec
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+# Fuseau horaire du groupe (pubs, fin des bans)
+TZ_CAIRO = ZoneInfo('Africa/Cairo')
+
 # Configuration du logging dès le début
 configure_logging()
 logger = get_logger(__name__)
@@ -25,129 +50,201 @@ logger = get_logger(__name__)
 load_dotenv()
 telegram_app = None
 
+# Sous gunicorn, le worker qui fait tourner le bot tient ce verrou
+BOT_LOCK_FILE = "/tmp/telegram_bot.lock"
+
+# RUN_BOT_IN_WEB=0 : les workers gunicorn ne lancent pas le bot, qui tourne dans
+# un service séparé (python main.py bot, voir render.yaml). Un seul processus
+# doit faire le polling et les envois planifiés
+RUN_BOT_IN_WEB = os.getenv('RUN_BOT_IN_WEB', '1') != '0'
+
+def bot_status_label():
+    """running / stopped, ou external quand le bot tourne dans un autre service"""
+    if bot_is_running():
+        return "running"
+    return "stopped" if RUN_BOT_IN_WEB else "external"
+
+def bot_is_running():
+    """Le bot tourne-t-il ? Les workers gunicorn sans telegram_app sondent le verrou du bot"""
+    if telegram_app is not None and telegram_app.running:
+        return True
+    try:
+        with open(BOT_LOCK_FILE, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    except OSError:
+        pass
+    return False
+
 # Configuration Flask pour Render
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-key-change-in-production')
 
+def json_dumps(obj):
+    """Sérialise en JSON (bytes), avec orjson quand il est installé"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+def json_response(obj, status=200):
+    """Réponse JSON sérialisée avec json_dumps"""
+    return app.response_class(json_dumps(obj), status=status, mimetype='application/json')
+
+# Les sondes Render/UptimeRobot frappent /health et /ping en boucle :
+# la réponse de /health est mise en cache, celle de /ping est constante
+HEALTH_CACHE_TTL = 27  # secondes
+_HC_CACHE = {"response": None, "exp": 0.0}
+
+_PING_RESPONSE = app.response_class(b"pong", status=200, mimetype='text/plain')
+
 
 @app.route('/')
 def home():
     try:
         logger.info("Requête reçue sur /")
-        return jsonify({
+        return json_response({
             "status": "R2D2 connecté",
             "timestamp": datetime.now().isoformat(),
-            "bot_running": telegram_app is not None
-        }), 200
+            "bot_running": bot_is_running()
+        })
     except Exception as e:
-        logger.error(f"Erreur dans home(): {e}")
-        return jsonify({"error": "Erreur serveur"}), 500
+        logger.error("Erreur dans home(): %s", e)
+        return json_response({"error": "Erreur serveur"}, 500)
 
 @app.route('/health')
 def health_check():
     """Health check endpoint pour Render et UptimeRobot"""
-    try:
-        bot_status = "running" if telegram_app else "stopped"
-        logger.debug("Health check requis")
-        return jsonify({
+    if time.monotonic() >= _HC_CACHE["exp"]:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Health check requis")
+        response = json_response({
             "status": "OK",
             "message": "Service running",
-            "bot_status": bot_status,
+            "bot_status": bot_status_label(),
             "timestamp": datetime.now().isoformat(),
             "version": "2.0"
-        }), 200
-    except Exception as e:
-        logger.error(f"Erreur dans health_check(): {e}")
-        return jsonify({"status": "ERROR", "message": str(e)}), 500
+        })
+        _HC_CACHE.update(response=response, exp=time.monotonic() + HEALTH_CACHE_TTL)
+
+    return _HC_CACHE["response"]
 
 @app.route('/ping')
 def ping():
     """Endpoint simple pour keepalive"""
-    return "pong", 200
+    return _PING_RESPONSE
 
 @app.route('/bot/status')
 def bot_status():
     """Status du bot Telegram"""
     try:
-        if telegram_app:
-            return jsonify({
+        if bot_is_running():
+            # L'identifiant n'est connu que du processus qui fait tourner le bot
+            local = telegram_app is not None and telegram_app.running
+            return json_response({
                 "bot_status": "running",
-                "bot_id": telegram_app.bot.id if telegram_app.bot else None
-            }), 200
+                "bot_id": telegram_app.bot.id if local else None
+            })
         else:
-            return jsonify({"bot_status": "stopped"}), 200
+            return json_response({"bot_status": bot_status_label()})
     except Exception as e:
-        logger.error(f"Erreur bot_status(): {e}")
-        return jsonify({"error": str(e)}), 500
-
-@app.errorhandler(404)
-def not_found_error(error):
-    logger.warning(f"404 - Page non trouvée: {error}")
-    return jsonify({"error": "Page non trouvée"}), 404
+        logger.error("Erreur bot_status(): %s", e)
+        return json_response({"error": str(e)}, 500)
 
-@app.errorhandler(500)
-def internal_error(error):
-    logger.error(f"500 - Erreur interne: {error}")
-    return jsonify({"error": "Erreur interne du serveur"}), 500
+# Réponses d'erreur construites une seule fois, indexées par code HTTP
+_ERROR_RESPONSES = {
+    404: json_response({"error": "Page non trouvée"}, 404),
+    500: json_response({"error": "Erreur interne du serveur"}, 500),
+}
+_UNEXPECTED_ERROR_RESPONSE = json_response({"error": "Une erreur inattendue s'est produite"}, 500)
+
+# Chemins sondés par les scanners : ces 404 sont attendues, inutile de les logger
+_SCANNER_PATHS = frozenset({
+    '/wp-admin', '/wp-login.php', '/xmlrpc.php', '/.env', '/.git/config', '/favicon.ico', '/robots.txt',
+})
+
+@app.errorhandler(HTTPException)
+def handle_http_error(error):
+    """Gère les erreurs HTTP (404, 500, ...) avec des réponses pré-construites"""
+    if error.code == 404:
+        if request.path not in _SCANNER_PATHS:
+            logger.warning("404 - Page non trouvée: %s", request.path)
+    elif error.code >= 500:
+        logger.error("%s - Erreur interne: %s", error.code, error)
+    return _ERROR_RESPONSES.get(error.code, error)
 
 @app.errorhandler(Exception)
 def handle_exception(e):
     """Gère toutes les exceptions non catchées"""
-    logger.error(f"Exception non gérée: {e}", exc_info=True)
-    return jsonify({"error": "Une erreur inattendue s'est produite"}), 500
+    logger.error("Exception non gérée: %s", e, exc_info=True)
+    return _UNEXPECTED_ERROR_RESPONSE
 
-def setup_signal_handlers():
+def setup_signal_handlers(stop_event):
     """Configure les gestionnaires de signaux pour un arrêt propre"""
-    def signal_handler(sig, frame):
-        logger.info(f"Signal {sig} reçu, arrêt en cours...")
-        if telegram_app:
-            logger.info("Arrêt du bot Telegram...")
-            try:
-                # Arrêt propre du bot
-                asyncio.create_task(telegram_app.stop())
-            except Exception as e:
-                logger.error(f"Erreur lors de l'arrêt du bot: {e}")
-        sys.exit(0)
-    
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    def signal_handler(sig):
+        logger.info("Signal %s reçu, arrêt en cours...", sig)
+        stop_event.set()
+
+    # Installés sur la boucle : le handler s'exécute dans la boucle elle-même
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, signal_handler, sig)
 
 def setup_telegram_bot():
     """Configuration du bot Telegram (handlers, token, etc.)"""
     global telegram_app
-    load_dotenv()
 
     token = os.getenv('TOKEN')
     if not token:
         logger.error("Token Telegram manquant!")
         return None
     
-    # Création de l'application Telegram
-    telegram_app = Application.builder().token(token).build()
+    # Création de l'application Telegram. Le rate limiter met en file les appels
+    # sortants sous le plafond global de Telegram (30 requêtes/s) et rejoue les
+    # requêtes refusées avec retry_after. Pas de limiteur par groupe : PTB
+    # l'applique à toute requête vers le groupe (suppressions, getChatAdministrators,
+    # ban...), un album ou quelques commandes épuiseraient le budget et, sans
+    # concurrent_updates, bloqueraient tous les handlers jusqu'à une minute
+    rate_limiter = AIORateLimiter(
+        overall_max_rate=28,
+        overall_time_period=1,
+        group_max_rate=0,
+        max_retries=3,
+    )
+    telegram_app = (
+        Application.builder()
+        .token(token)
+        .rate_limiter(rate_limiter)
+        # Pool partagé pour les handlers concurrents (une seule connexion par défaut),
+        # et pool séparé pour le long polling de getUpdates
+        .request(HTTPXRequest(connection_pool_size=32, pool_timeout=30, connect_timeout=10, read_timeout=20))
+        .get_updates_request(HTTPXRequest(connection_pool_size=4, pool_timeout=30))
+        .post_init(post_init)
+        .build()
+    )
     
-    # Enregistrement des commandes
-    for cmd in COMMAND_MAPPINGS.keys():
-        telegram_app.add_handler(CommandHandler(cmd, generic_info_command))
-
-    for savant_id in SAVANTS_INFO.keys():
-        telegram_app.add_handler(CommandHandler(savant_id, savant_command_handler))
-
-    telegram_app.add_handler(CommandHandler('reload', reload_messages))
-    telegram_app.add_handler(CommandHandler('start', start))
-    telegram_app.add_handler(CommandHandler('envoyer_pub_entreprise', envoyer_pub_entreprise))
-    telegram_app.add_handler(CommandHandler('getid', get_chat_id))
-    telegram_app.add_handler(CommandHandler('help', help_command))
     telegram_app.add_handler(ChatMemberHandler(chat_member_handler, ChatMemberHandler.CHAT_MEMBER))
     telegram_app.add_handler(MessageHandler(filters.PHOTO, handle_album))
-    telegram_app.add_handler(CommandHandler('ban', ban_command))
 
-    # Gestionnaire pour les commandes inconnues - doit être ajouté en DERNIER
-    telegram_app.add_handler(MessageHandler(filters.COMMAND, unknown_command))
+    # Toutes les commandes (y compris les inconnues) passent par un seul handler
+    telegram_app.add_handler(MessageHandler(filters.COMMAND, dispatch_command))
     
     logger.info("Tous les handlers enregistrés avec succès")
     return telegram_app
 
 
+# Paramètres de polling communs au thread (gunicorn) et à la boucle unique.
+# Long polling : Telegram garde la requête ouverte jusqu'à 30 s et répond dès
+# qu'un update arrive ; les updates reçus pendant un redéploiement sont traités
+# au redémarrage au lieu d'être jetés. Pas besoin de persister l'offset : chaque
+# getUpdates envoie offset = dernier update_id + 1, ce qui acquitte côté
+# Telegram tout ce qui a déjà été reçu (et PicklePersistence ne le stocke pas)
+POLLING_OPTIONS = {
+    "allowed_updates": ["message", "chat_member", "my_chat_member"],
+    "poll_interval": 0,
+    "timeout": 30,
+}
+
 def run_telegram_bot():
     """Démarre le bot Telegram (bloquant)."""
     global telegram_app
@@ -160,45 +257,202 @@ def run_telegram_bot():
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
 
-        telegram_app.run_polling(
-            allowed_updates=["message", "chat_member", "my_chat_member"],
-            poll_interval=3,
-            drop_pending_updates=True,
-            stop_signals=None
-        )
+        telegram_app.run_polling(**POLLING_OPTIONS, stop_signals=None)
         logger.info("Bot Telegram démarré avec succès")
     except Exception as e:
-        logger.error(f"Erreur dans run_telegram_bot: {e}", exc_info=True)
+        logger.error("Erreur dans run_telegram_bot: %s", e, exc_info=True)
+
 
+bot_thread = None
 
 def start_telegram_bot_thread():
-    """Démarre le bot Telegram dans un thread séparé"""
+    """Démarre le bot Telegram dans un thread séparé (une seule fois par processus)"""
+    global bot_thread
+    if bot_thread is not None and bot_thread.is_alive():
+        logger.info("Thread du bot Telegram déjà actif")
+        return bot_thread
+
+    # L'application est créée ici, après le fork, pour que son client HTTP
+    # n'appartienne qu'au processus qui fait tourner le bot
+    if telegram_app is None:
+        setup_telegram_bot()
+
     try:
         bot_thread = threading.Thread(target=run_telegram_bot, daemon=True)
         bot_thread.start()
         logger.info("Thread du bot Telegram démarré")
         return bot_thread
     except Exception as e:
-        logger.error(f"Erreur lors du démarrage du thread bot: {e}")
+        logger.error("Erreur lors du démarrage du thread bot: %s", e)
         return None
 
-    
-# Chargement des variables d'environnement
-load_dotenv()
-chat_id = int(os.getenv('CHAT_ID'))
 
-media_groups = defaultdict(list)
-timers = {}
+async def run_bot_and_web(port):
+    """Fait tourner le bot et le serveur HTTP sur une seule boucle asyncio"""
+    stop_event = asyncio.Event()
+    setup_signal_handlers(stop_event)
+
+    # Même séquence que run_polling, sans lui laisser la boucle. Un échec au
+    # démarrage (token invalide, réseau absent) n'empêche pas de servir /health
+    bot_started = False
+    if telegram_app:
+        try:
+            await telegram_app.initialize()
+            if telegram_app.post_init:
+                await telegram_app.post_init(telegram_app)
+            await telegram_app.updater.start_polling(**POLLING_OPTIONS)
+            await telegram_app.start()
+            bot_started = True
+            logger.info("Bot Telegram démarré avec succès")
+        except Exception as e:
+            logger.error("Impossible de démarrer le bot Telegram: %s", e, exc_info=True)
+            await _stop_telegram_app()
+
+    config = HypercornConfig()
+    config.bind = [f"0.0.0.0:{port}"]
+    try:
+        # Hypercorn sert l'application WSGI Flask depuis son pool de threads
+        await hypercorn_serve(app, config, mode="wsgi", shutdown_trigger=stop_event.wait)
+    finally:
+        if bot_started:
+            logger.info("Arrêt du bot Telegram...")
+            await _stop_telegram_app()
+
+async def _stop_telegram_app():
+    """Arrête ce qui a été démarré du bot (aussi après un démarrage partiel)"""
+    try:
+        if telegram_app.updater.running:
+            await telegram_app.updater.stop()
+        if telegram_app.running:
+            await telegram_app.stop()
+        await telegram_app.shutdown()
+    except Exception as e:
+        logger.error("Erreur à l'arrêt du bot Telegram: %s", e)
+
+
+@functools.cache
+def get_group_chat_id():
+    """ID du groupe (CHAT_ID), lu au premier envoi : l'import ne dépend pas de la variable"""
+    return int(os.getenv('CHAT_ID'))
 
 # Délai après lequel on considère l'album complet
 WAIT_TIME = 3  # secondes
 
+# Albums en cours de réception : {media_group_id: [messages]}. Taille et durée
+# de vie bornées : un flood d'albums ne peut pas faire grossir la mémoire
+media_groups = TTLCache(maxsize=2048, ttl=30)
+
 # Messages
 def charger_messages(path='messages.yaml'):
+    """Charge les messages, depuis le cache JSON tant qu'il est à jour du YAML"""
+    cache = path + '.cache.json'
+    try:
+        if os.stat(cache).st_mtime_ns >= os.stat(path).st_mtime_ns:
+            with open(cache, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass  # Pas de cache (ou cache illisible) : on relit le YAML
+
     with open(path, 'r', encoding='utf-8') as f:
-        return yaml.safe_load(f)
+        messages = yaml.load(f, Loader=_YamlLoader)
 
-MESSAGES = charger_messages()
+    # Écriture atomique du cache ; un disque en lecture seule n'est pas bloquant
+    tmp = f"{cache}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(messages, f, ensure_ascii=False)
+        os.replace(tmp, cache)
+    except (OSError, TypeError) as e:
+        logger.warning("Cache des messages non écrit: %s", e)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return messages
+
+# Messages chargés au premier accès (post_init côté bot) : le serveur HTTP
+# démarre sans attendre la lecture de messages.yaml
+MESSAGES = None
+_messages_lock = threading.Lock()
+
+def get_messages():
+    """Retourne les messages, en les chargeant au premier appel"""
+    global MESSAGES
+    if MESSAGES is None:
+        with _messages_lock:
+            if MESSAGES is None:
+                messages = charger_messages()
+                _build_pub_index(messages)
+                MESSAGES = messages
+    return MESSAGES
+
+# Pubs regroupées par jour du cycle de 3 jours (e1, e4... le 1er jour, e2, e5... le 2e)
+_PUB_RE = re.compile(r'^e(\d+)$')
+_LINK_RE = re.compile(r'^le(\d+)_')
+PUBS_BY_CYCLE = [[], [], []]
+PUB_CYCLE_START = datetime(2025, 6, 20, tzinfo=TZ_CAIRO)
+
+def _build_pub_index(messages):
+    """Prépare en un seul passage les pubs de chaque jour du cycle :
+    (clé, texte final, boutons de liens, clé des images), triées par numéro"""
+    global PUBS_BY_CYCLE
+    config = messages.get('publicite_entreprise', {})
+    pubs = config.get('pub', {})
+    prefix = config.get('prefix', '')
+    suffix = config.get('suffix', '')
+    separation = config.get('separation', '')
+
+    annonces = []
+    boutons = defaultdict(list)
+    for cle, valeur in pubs.items():
+        match = _PUB_RE.match(cle)
+        if match:
+            annonces.append((int(match.group(1)), cle, match.group(1), valeur))
+            continue
+
+        # Lien interactif : le<numéro>_<n>: "url | libellé"
+        match = _LINK_RE.match(cle)
+        if match:
+            try:
+                url, label = [s.strip() for s in valeur.split("|", 1)]
+                boutons[match.group(1)].append(InlineKeyboardButton(label, url=url))
+            except ValueError:
+                logger.warning(f"❌ Format invalide pour le lien {cle}")
+
+    cycles = [[], [], []]
+    for numero, cle, cle_num, contenu in sorted(annonces):
+        texte_final = f"{separation}\n{prefix}\n{separation}\n\n{contenu}\n\n{separation}\n{suffix}\n{separation}"
+        liens = boutons.get(cle_num)
+        markup = InlineKeyboardMarkup([[btn] for btn in liens]) if liens else None
+        cycles[(numero - 1) % 3].append((cle, texte_final, markup, cle_num))
+    PUBS_BY_CYCLE = cycles
+
+# Images des pubs (img/e<numéro>_*.png|jpg|jpeg) : répertoire parcouru une fois,
+# seuls les chemins sont gardés en mémoire
+IMAGE_DIR = "./img"
+_PUB_IMAGE_RE = re.compile(r'e(\d+)_')
+PUB_IMAGES = {}
+
+def charger_images_pubs(image_dir=IMAGE_DIR):
+    """Indexe les images des pubs en un seul parcours : {numéro: [chemin, ...]} par nom de fichier"""
+    images = defaultdict(list)
+    try:
+        entries = sorted(os.scandir(image_dir), key=lambda entry: entry.name)
+    except OSError as e:
+        logger.warning("Répertoire d'images %s illisible: %s", image_dir, e)
+        return images
+
+    for entry in entries:
+        match = _PUB_IMAGE_RE.match(entry.name)
+        if match and entry.name.endswith((".png", ".jpg", ".jpeg")):
+            images[match.group(1)].append(entry.path)
+    return images
+
+def preparer_media_group(image_paths):
+    """Lit les images (appel bloquant, à lancer dans un thread) pour send_media_group"""
+    media_group = []
+    for image_path in image_paths:
+        with open(image_path, "rb") as photo:
+            media_group.append(InputMediaPhoto(photo))
+    return media_group
 
 COMMAND_MAPPINGS = {
     'fourqanfemme': 'fourqanFemme',
@@ -254,34 +508,70 @@ SAVANTS_INFO = {
     }
 }
 
+def _format_savant(savant_id):
+    """Construit la fiche d'un savant envoyée en privé"""
+    info = SAVANTS_INFO[savant_id]
+    message = f"- {info['nom']}\n\n"
+    
+    if info['description']:
+        message += f"{info['description']}\n\n"
+        
+    message += "📍 Localisation jumuah/cours :\n\n"
+    message += f"{info['localisation']}\n"
+    
+    if 'localisation_cours' in info and info['localisation_cours']:
+        message += f"\nCours :\n\n{info['localisation_cours']}\n"
+        
+    if info['telegram']:
+        message += f"\nℹ️ Chaîne telegram :\n\n{info['telegram']}"
+        
+    return message
+
+# Textes figés (ne dépendent pas de messages.yaml) : construits une seule fois
+SAVANT_MESSAGES = {savant_id: _format_savant(savant_id) for savant_id in SAVANTS_INFO}
+
+HELP_TEXT = (
+    "📋 Commandes disponibles :\n\n"
+    "ℹ️ Informations générales :\n"
+    f"{', '.join(f'/{cmd}' for cmd in COMMAND_MAPPINGS)}\n\n"
+    "👳‍♂️ Savants :\n"
+    f"{', '.join(f'/{savant}' for savant in SAVANTS_INFO)}\n\n"
+    "⚙️ Autres commandes :\n"
+    "/help - Affiche cette aide\n"
+    "/start - Démarre le bot"
+)
+
+# Statuts qui comptent comme « membre du groupe »
+_ACTIVE_MEMBERSHIP = frozenset({
+    ChatMemberStatus.MEMBER,
+    ChatMemberStatus.OWNER,
+    ChatMemberStatus.ADMINISTRATOR,
+})
+
 def extract_status_change(chat_member_update):
     """Extrait le changement de statut d'un ChatMemberUpdated"""
     old_status = chat_member_update.old_chat_member.status
     new_status = chat_member_update.new_chat_member.status
     
-    was_member = old_status in [
-        ChatMemberStatus.MEMBER,
-        ChatMemberStatus.OWNER,
-        ChatMemberStatus.ADMINISTRATOR,
-    ]
-    is_member = new_status in [
-        ChatMemberStatus.MEMBER,
-        ChatMemberStatus.OWNER,
-        ChatMemberStatus.ADMINISTRATOR,
-    ]
+    was_member = old_status in _ACTIVE_MEMBERSHIP
+    is_member = new_status in _ACTIVE_MEMBERSHIP
     
     logger.info(f"Ancien statut: {old_status}, Nouveau statut: {new_status}")
     logger.info(f"was_member: {was_member}, is_member: {is_member}")
     
     return was_member, is_member
 
+# Durées de ban : 30m, 1h, 7d ou 7j
+_DURATION_RE = re.compile(r'^(\d+)([mhdj])$')
+
+@functools.lru_cache(maxsize=64)
 def parse_duration(duration_str):
-    """Parse la durée du ban (ex: 1h, 30m, 7d, permanent)"""
+    """Parse la durée du ban (ex: 1h, 30m, 7d, permanent), mémorisée : timedelta est immuable"""
     if not duration_str or duration_str.lower() in ['permanent', 'perm', 'definitif']:
         return None  # Ban permanent
     
     # Regex pour capturer les durées (ex: 1h, 30m, 7d)
-    match = re.match(r'^(\d+)([mhdj])$', duration_str.lower())
+    match = _DURATION_RE.match(duration_str.lower())
     if not match:
         return False  # Format invalide
     
@@ -317,12 +607,27 @@ def format_duration(duration):
     
     return " et ".join(parts) if parts else "moins d'une minute"
 
+# Administrateurs par groupe : {chat_id: tâche -> {user_id}}. La tâche est
+# partagée, les vérifications simultanées d'un même /ban ne font qu'un appel
+ADMIN_CACHE_TTL = 30  # secondes
+_admin_cache = TTLCache(maxsize=256, ttl=ADMIN_CACHE_TTL)
+
+async def _fetch_admin_ids(bot, chat_id):
+    admins = await bot.get_chat_administrators(chat_id)
+    return {admin.user.id for admin in admins}
+
 """Vérifie si l'utilisateur est administrateur du groupe"""
 async def is_user_admin(context, chat_id, user_id):
+    tache = _admin_cache.get(chat_id)
+    if tache is None:
+        tache = asyncio.ensure_future(_fetch_admin_ids(context.bot, chat_id))
+        _admin_cache[chat_id] = tache
     try:
-        chat_member = await context.bot.get_chat_member(chat_id, user_id)
-        return chat_member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
+        return user_id in await asyncio.shield(tache)
     except Exception as e:
+        # Ne pas garder l'échec en cache
+        if _admin_cache.get(chat_id) is tache:
+            del _admin_cache[chat_id]
         logger.error(f"Erreur lors de la vérification admin: {e}")
         return False
     
@@ -359,21 +664,16 @@ async def chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         logger.info(f"Nouveau membre détecté: {prenom} (ID: {user_id})")
         
         # Message de bienvenue dans le groupe
-        bouton = InlineKeyboardMarkup([
-            [InlineKeyboardButton("📩 Cliquez ici pour activer le bot", url=f"https://t.me/{context.bot.username}?start=welcome")]
-        ])
-        
         message_publique = f'Bienvenue <a href="tg://user?id={user_id}">{prenom}</a> ! Pour recevoir des infos importantes, activez le bot 👇'
         try:
             message_obj = await context.bot.send_message(
             chat_id=update.chat_member.chat.id,
             text=message_publique,
-            reply_markup=bouton,
+            reply_markup=WELCOME_KEYBOARD,
             parse_mode=ParseMode.HTML,
             )
 
-            await asyncio.sleep(10)
-            await message_obj.delete()
+            context.job_queue.run_once(_delete_later, 10, data=message_obj)
             logger.info(f"✅ Message de bienvenue envoyé dans le groupe pour {prenom}")
 
         except Exception as e:
@@ -390,6 +690,16 @@ async def supprimer_message(message: Message):
         else:
             logger.info(f"❌ Erreur inattendue : {e}")
 
+async def _delete_later(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job du job_queue : supprime le message passé dans data"""
+    await supprimer_message(context.job.data)
+
+async def _reply_ephemeral(update: Update, context: ContextTypes.DEFAULT_TYPE, text, *, ttl=10, parse_mode=None):
+    """Répond à la commande puis programme la suppression de la réponse et de la commande"""
+    reponse = await update.message.reply_text(text, parse_mode=parse_mode)
+    for message in (reponse, update.message):
+        context.job_queue.run_once(_delete_later, ttl, data=message)
+
 """Fonction générique pour envoyer un message privé avec gestion d'erreur"""
 async def send_private_message(context, user, message_text, command_name, update):
     try:
@@ -399,40 +709,20 @@ async def send_private_message(context, user, message_text, command_name, update
     except Exception as e:
         logger.error(f"❌ Erreur d'envoi à {user.first_name} via /{command_name} : {e}")
         
-        bouton = InlineKeyboardMarkup([
-            [InlineKeyboardButton("📩 Activer le bot", url=f"https://t.me/{context.bot.username}?start=start")]
-        ])
-        
         msg_bot = await update.message.reply_text(
             "❌ Je n'ai pas pu t'envoyer le message en privé. Active le bot ici 👇",
-            reply_markup=bouton
+            reply_markup=ACTIVATE_KEYBOARD
         )
         
-        await asyncio.sleep(10)
-        await msg_bot.delete()
+        context.job_queue.run_once(_delete_later, 10, data=msg_bot)
         return False
 
 """Fonction générique pour envoyer les info sur les savants"""
 async def get_savant_info(savant_id):    
-    if savant_id not in SAVANTS_INFO:
-        return "Information non disponible pour ce savant."
-        
-    info = SAVANTS_INFO[savant_id]
-    message = f"- {info['nom']}\n\n"
-    
-    if info['description']:
-        message += f"{info['description']}\n\n"
-        
-    message += "📍 Localisation jumuah/cours :\n\n"
-    message += f"{info['localisation']}\n"
-    
-    if 'localisation_cours' in info and info['localisation_cours']:
-        message += f"\nCours :\n\n{info['localisation_cours']}\n"
-        
-    if info['telegram']:
-        message += f"\nℹ️ Chaîne telegram :\n\n{info['telegram']}"
-        
-    return message    
+    return SAVANT_MESSAGES.get(savant_id, "Information non disponible pour ce savant.")
+
+# Commandes du bot hors COMMAND_MAPPINGS et SAVANTS_INFO
+_OTHER_COMMANDS = frozenset({'start', 'reload', 'reload_images', 'help', 'getid'})
 
 """Fonction pour vérifier si une commande existe"""
 def command_exists(command_name):
@@ -440,7 +730,7 @@ def command_exists(command_name):
     clean_command = command_name.split('@')[0]
     
     # Vérifie si la commande existe dans COMMAND_MAPPINGS ou SAVANTS_INFO
-    return clean_command in COMMAND_MAPPINGS or clean_command in SAVANTS_INFO or clean_command in ['start', 'reload', 'help', 'getid', 'envoyer_pub_entreprise']
+    return clean_command in COMMAND_MAPPINGS or clean_command in SAVANTS_INFO or clean_command in _OTHER_COMMANDS
 
 """Gestionnaire générique pour toutes les commandes de savants"""
 async def savant_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -458,8 +748,7 @@ async def savant_command_handler(update: Update, context: ContextTypes.DEFAULT_T
         await update.message.reply_text(f"La commande /{savant_id} n'existe pas. Vérifiez la liste des commandes disponibles avec /help.")
         
         # Supprimer le message d'erreur après un court délai
-        await asyncio.sleep(5)
-        await supprimer_message(update.message)
+        context.job_queue.run_once(_delete_later, 5, data=update.message)
         return
     
     # Génère le message d'information pour ce savant
@@ -474,8 +763,7 @@ async def savant_command_handler(update: Update, context: ContextTypes.DEFAULT_T
     )
     
     # Supprimer le message de commande après un court délai
-    await asyncio.sleep(5)
-    await supprimer_message(update.message)
+    context.job_queue.run_once(_delete_later, 5, data=update.message)
 
 """Gestionnaire pour toutes les commandes d'information"""
 async def generic_info_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -488,8 +776,7 @@ async def generic_info_command(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text(f"La commande /{command} n'existe pas. Vérifiez la liste des commandes disponibles avec /help.")
         
         # Supprimer le message d'erreur après un court délai
-        await asyncio.sleep(5)
-        await supprimer_message(update.message)
+        context.job_queue.run_once(_delete_later, 5, data=update.message)
         return
     
     message_key = COMMAND_MAPPINGS[command]
@@ -498,104 +785,48 @@ async def generic_info_command(update: Update, context: ContextTypes.DEFAULT_TYP
     await send_private_message(
         context=context,
         user=user,
-        message_text=MESSAGES[message_key],
+        message_text=get_messages()[message_key],
         command_name=command,
         update=update
     )
     
-    await asyncio.sleep(5)
-    await supprimer_message(update.message)
+    context.job_queue.run_once(_delete_later, 5, data=update.message)
 
 async def envoyer_pub_entreprise(application):
-    deja_envoye = set()
-    pubs = MESSAGES.get('publicite_entreprise', {}).get('pub', {})
-    prefix = MESSAGES.get('publicite_entreprise', {}).get('prefix', '')
-    suffix = MESSAGES.get('publicite_entreprise', {}).get('suffix', '')
-    separation = MESSAGES.get('publicite_entreprise',{}).get('separation', '')
+    """Envoie les pubs du jour, une par heure à partir de 12h (heure du Caire)"""
+    maintenant = datetime.now(TZ_CAIRO)
+    jour_cycle = (maintenant - PUB_CYCLE_START).days % 3
 
-    # Configuration du fuseau horaire égyptien
-    timezone_egypt = pytz.timezone('Africa/Cairo')
-    jour_debut = datetime(2025, 6, 20, tzinfo=timezone_egypt)
-    
-    while True:
-        maintenant = datetime.now(timezone_egypt)
-        delta_jours = (maintenant - jour_debut).days
-        jour_cle = maintenant.strftime("%Y-%m-%d")
-        jour_cycle = delta_jours % 3
+    for i, (cle, texte_final, markup, cle_num) in enumerate(PUBS_BY_CYCLE[jour_cycle]):
+        # La première pub part à 12h, les suivantes à 13h, 14h...
+        await sleep_until(datetime.combine(maintenant.date(), dt_time(12 + i, 0), tzinfo=TZ_CAIRO))
 
-        pubs_du_jour = []
+        # Images indexées au démarrage (ou par /reload_images)
+        images_a_envoyer = PUB_IMAGES.get(cle_num, [])
 
-        for cle in pubs:
+        # Envoi des images en groupe (média group)
+        if images_a_envoyer:
             try:
-                numero = int(cle[1:])  # extrait 1 de e1, 10 de e10
-                if (numero - 1) % 3 == jour_cycle:
-                    pubs_du_jour.append((numero, cle))
-            except ValueError:
-                pass
-
-        # Trier par numéro (ex: e1 avant e4)
-        pubs_du_jour.sort()
-
-        for i, (_, cle) in enumerate(pubs_du_jour):
-            if maintenant.hour == 12 + i and maintenant.minute == 0 and jour_cle not in deja_envoye:
-                contenu = pubs[cle]
-                texte_final = f"{separation}\n{prefix}\n{separation}\n\n{contenu}\n\n{separation}\n{suffix}\n{separation}"
-                boutons = []
-                cle_num = cle[1:]
-                image_dir = "./img"
-
-                # Collecte des images pour envoi en groupe
-                images_a_envoyer = []
-                for file in sorted(os.listdir(image_dir)):
-                    if file.startswith(f"e{cle_num}_") and file.endswith((".png", ".jpg", ".jpeg")):
-                        try:
-                            images_a_envoyer.append(os.path.join(image_dir, file))
-                        except Exception as e:
-                            logger.warning(f"❌ Erreur préparation image {file} : {e}")
-
-                # Envoi des images en groupe (média group)
-                if images_a_envoyer:
-                    try:
-                        media_group = []
-                        for image_path in images_a_envoyer:
-                            with open(image_path, "rb") as photo:
-                                media_group.append(InputMediaPhoto(photo.read()))
-                        
-                        await application.bot.send_media_group(
-                            chat_id=chat_id,# 5700380278
-                            media=media_group
-                        )
-                        logger.info(f"✅ {len(images_a_envoyer)} images envoyées en groupe pour {cle}")
-                    except Exception as e:
-                        logger.warning(f"❌ Erreur envoi groupe d'images pour {cle} : {e}")
-
-                # Creation des boutons de liens interactifs
-                for key, value in pubs.items():
-                    if key.startswith(f"le{cle_num}_"):
-                        try:
-                            url, label = [s.strip() for s in value.split("|", 1)]
-                            boutons.append(InlineKeyboardButton(label, url=url))
-                            logger.info(f" Format valide pour le lien {key}")
-                        except ValueError:
-                            logger.warning(f"❌ Format invalide pour le lien {key}")
-
-                markup = InlineKeyboardMarkup([[btn] for btn in boutons]) if boutons else None
-
-                try:
-                    await application.bot.send_message(
-                        chat_id=chat_id,# 5700380278
-                        text=texte_final,
-                        parse_mode=ParseMode.MARKDOWN,
-                        reply_markup = markup
-                    )
-                    logger.info(f"📢 Pub '{cle}' envoyée à {12 + i}h.")
-                except Exception as e:
-                    logger.error(f"❌ Erreur pub '{cle}' : {e}")
-
-            if maintenant.hour >= 12:
-                deja_envoye.add(jour_cle)
-
-        await asyncio.sleep(60)
+                # Fichiers lus au moment de l'envoi, hors de la boucle asyncio
+                media_group = await asyncio.to_thread(preparer_media_group, images_a_envoyer)
+                await application.bot.send_media_group(
+                    chat_id=get_group_chat_id(),# 5700380278
+                    media=media_group
+                )
+                logger.info(f"✅ {len(images_a_envoyer)} images envoyées en groupe pour {cle}")
+            except Exception as e:
+                logger.warning(f"❌ Erreur envoi groupe d'images pour {cle} : {e}")
+
+        try:
+            await application.bot.send_message(
+                chat_id=get_group_chat_id(),# 5700380278
+                text=texte_final,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup = markup
+            )
+            logger.info(f"📢 Pub '{cle}' envoyée à {12 + i}h.")
+        except Exception as e:
+            logger.error(f"❌ Erreur pub '{cle}' : {e}")
 
 """Gestionnaire pour les commandes inconnues"""
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -608,47 +839,41 @@ async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         f"La commande /{command} n'existe pas. Utilisez /help pour voir la liste des commandes disponibles.")
     
     # Supprimer les messages après un court délai
-    await asyncio.sleep(5)
-    await supprimer_message(update.message)
-    await supprimer_message(response)
+    context.job_queue.run_once(_delete_later, 5, data=update.message)
+    context.job_queue.run_once(_delete_later, 5, data=response)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Affiche la liste des commandes disponibles"""
-    info_commands = ", ".join([f"/{cmd}" for cmd in COMMAND_MAPPINGS.keys()])
-    savant_commands = ", ".join([f"/{savant}" for savant in SAVANTS_INFO.keys()])
-    
-    help_text = (
-        "📋 Commandes disponibles :\n\n"
-        "ℹ️ Informations générales :\n"
-        f"{info_commands}\n\n"
-        "👳‍♂️ Savants :\n"
-        f"{savant_commands}\n\n"
-        "⚙️ Autres commandes :\n"
-        "/help - Affiche cette aide\n"
-        "/start - Démarre le bot"
-    )
-    
     user = update.effective_user
     await send_private_message(
         context=context, 
         user=user, 
-        message_text=help_text,
+        message_text=HELP_TEXT,
         command_name="help",
         update=update
     )
     
     # Supprimer le message de commande
-    await asyncio.sleep(5)
-    await supprimer_message(update.message)
+    context.job_queue.run_once(_delete_later, 5, data=update.message)
 
 async def reload_messages(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     global MESSAGES
-    MESSAGES = charger_messages()
+    messages = await asyncio.to_thread(charger_messages)
+    with _messages_lock:
+        _build_pub_index(messages)
+        MESSAGES = messages
     await update.message.reply_text("♻️ Messages rechargés avec succès.")
 
      # Supprimer le message de commande après un court délai (ex: 5 secondes)
-    await asyncio.sleep(5)
-    await supprimer_message(update.message)
+    context.job_queue.run_once(_delete_later, 5, data=update.message)
+
+async def reload_images(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    global PUB_IMAGES
+    PUB_IMAGES = await asyncio.to_thread(charger_images_pubs)
+    await update.message.reply_text(f"🖼️ Images réindexées ({sum(map(len, PUB_IMAGES.values()))} fichiers).")
+
+    # Supprimer le message de commande après un court délai (ex: 5 secondes)
+    context.job_queue.run_once(_delete_later, 5, data=update.message)
 
 #   Commande initialisation bot 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -667,14 +892,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await send_private_message(
     context=context,
     user=user,
-    message_text=MESSAGES['bot_usage'],
+    message_text=get_messages()['bot_usage'],
     command_name='start',
     update=update
 )
     
     # Supprimer le message de commande après un court délai (ex: 5 secondes)
-    await asyncio.sleep(5)
-    await supprimer_message(update.message)
+    context.job_queue.run_once(_delete_later, 5, data=update.message)
     logger.info(f"✅ Utilisateur {prenom} ({user.id}) a démarré le bot.")
 
 async def get_chat_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -691,90 +915,167 @@ async def get_chat_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     )
 
 async def envoyer_rappel_lundi_jeudi(application):
-    while True:
-        maintenant = datetime.now()
-
-        # Si c'est lundi (0) ou jeudi (3) à 12h00
-        if maintenant.weekday() in [0, 3] and maintenant.hour == 12 and maintenant.minute == 0:
-            try:
-                await application.bot.send_message(chat_id=chat_id, text=MESSAGES['fr'])
-                await application.bot.send_message(chat_id=chat_id, text=MESSAGES['ar'])
-                logger.info("📌 Rappel envoyé à 12h (lundi ou jeudi)")
-            except Exception as e:
-                logger.error(f"❌ Erreur lors de l'envoi du rappel régulier : {e}")
-            
-            # Attendre 61 secondes pour éviter de le renvoyer plusieurs fois dans la même minute
-            await asyncio.sleep(61)
-        else:
-            # Vérifie toutes les 60 secondes
-            await asyncio.sleep(60)
+    # Uniquement le lundi (0) et le jeudi (3)
+    if datetime.now().weekday() not in {0, 3}:
+        return
+    try:
+        await application.bot.send_message(chat_id=get_group_chat_id(), text=get_messages()['fr'])
+        await application.bot.send_message(chat_id=get_group_chat_id(), text=get_messages()['ar'])
+        logger.info("📌 Rappel envoyé à 12h (lundi ou jeudi)")
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de l'envoi du rappel régulier : {e}")
 
 async def envoyer_rappel_mardi_vendredi_dimanche(application):
+    # Uniquement le mardi (1), le vendredi (4) et le dimanche (6)
+    if datetime.now().weekday() not in {1, 4, 6}:
+        return
+    try:
+        await application.bot.send_message(chat_id=get_group_chat_id(), text=get_messages()['bot_usage'])
+        logger.info("📌 Rappel des commandes envoyé à 12h (mardi ou vendredi, dimanche)")
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de l'envoi du rappel régulier : {e}")
+
+async def sleep_until(cible):
+    """Dort jusqu'à l'instant cible (datetime naïf = heure locale du serveur)"""
+    delai = cible.timestamp() - time.time()
+    if delai > 0:
+        await asyncio.sleep(delai)
+
+async def at_daily(hour, minute, tz, callback, *args):
+    """Appelle callback(*args) chaque jour à hour:minute dans le fuseau tz
+    (None = heure locale), avec un seul réveil par jour"""
+    heure = dt_time(hour, minute)
+    jour = datetime.now(tz).date()
     while True:
-        maintenant = datetime.now()
-
-        # Si c'est lundi (0) ou jeudi (3) à 12h00
-        if maintenant.weekday() in [1, 4, 6] and maintenant.hour == 12 and maintenant.minute == 0:
+        cible = datetime.combine(jour, heure, tzinfo=tz)
+        # Une échéance déjà passée (démarrage après l'heure) est sautée
+        if cible.timestamp() > time.time():
+            await sleep_until(cible)
             try:
-                await application.bot.send_message(chat_id=chat_id, text=MESSAGES['bot_usage'])
-                logger.info("📌 Rappel des commandes envoyé à 12h (mardi ou vendredi, dimanche)")
+                await callback(*args)
             except Exception as e:
-                logger.error(f"❌ Erreur lors de l'envoi du rappel régulier : {e}")
-            
-            # Attendre 61 secondes pour éviter de le renvoyer plusieurs fois dans la même minute
-            await asyncio.sleep(61)
-        else:
-            # Vérifie toutes les 60 secondes
-            await asyncio.sleep(60)
+                logger.error("Erreur dans la tâche planifiée %s : %s", callback.__name__, e, exc_info=True)
+        jour += timedelta(days=1)
 
-async def process_media_group(group_id: str, context: ContextTypes.DEFAULT_TYPE, user_first_name):
-    await asyncio.sleep(WAIT_TIME)
-    messages = media_groups.get(group_id, [])
+async def process_media_group(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job du job_queue : vérifie un album une fois complet (WAIT_TIME après la 1re photo)"""
+    messages = media_groups.pop(context.job.data, [])
     if not messages:
         return
 
     total_photos = len(messages)
     if total_photos > 4:
-        # Supprimer tous les messages du groupe
-        for msg in messages:
-            await supprimer_message(msg)
+        # Supprimer tous les messages du groupe, en parallèle
+        await asyncio.gather(*(supprimer_message(msg) for msg in messages), return_exceptions=True)
 
         # Envoyer un avertissement
         warning = await context.bot.send_message(
-            chat_id=chat_id,
-            text=f"🚫 {user_first_name}, vous ne pouvez pas envoyer plus de 4 photos à la fois.",
+            chat_id=get_group_chat_id(),
+            text=f"🚫 {messages[0].from_user.first_name}, vous ne pouvez pas envoyer plus de 4 photos à la fois.",
         )
 
-        # Supprimer l'avertissement après 5 secondes
-        await asyncio.sleep(10)
-        await supprimer_message(warning)
-
-    # Nettoyage
-    del media_groups[group_id]
-    del timers[group_id]
+        # Supprimer l'avertissement après 10 secondes
+        context.job_queue.run_once(_delete_later, 10, data=warning)
 
 async def handle_album(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.message
     group_id = message.media_group_id
-    prenom = update.message.from_user.first_name
 
     if not group_id:
         return
 
-    media_groups[group_id].append(message)
+    bucket = media_groups.get(group_id)
+    if bucket is None:
+        bucket = media_groups[group_id] = []
+
+        # Première photo de l'album : vérification programmée une seule fois
+        context.job_queue.run_once(process_media_group, WAIT_TIME, data=group_id)
 
-    # Si c'est le premier message du groupe, on lance un timer
-    if group_id not in timers:
-        timers[group_id] = asyncio.create_task(process_media_group(group_id, context, prenom))
+    bucket.append(message)
+
+# Identité du bot et boutons « activer le bot », renseignés par post_init
+BOT_USERNAME = None
+WELCOME_KEYBOARD = None
+ACTIVATE_KEYBOARD = None
+
+# Références vers les tâches planifiées (sinon le ramasse-miettes peut les collecter)
+taches_planifiees = []
 
 async def post_init(application):
     """Fonction exécutée après l'initialisation de l'application"""
-    asyncio.create_task(envoyer_rappel_lundi_jeudi(application))
-    asyncio.create_task(envoyer_rappel_mardi_vendredi_dimanche(application))
-    asyncio.create_task(envoyer_pub_entreprise(application)) 
+    global BOT_USERNAME, WELCOME_KEYBOARD, ACTIVATE_KEYBOARD, PUB_IMAGES
+
+    # Messages et index des pubs prêts avant la première commande
+    await asyncio.to_thread(get_messages)
+
+    # initialize() a déjà appelé get_me : le nom du bot est connu
+    BOT_USERNAME = application.bot.username
+    WELCOME_KEYBOARD = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📩 Cliquez ici pour activer le bot", url=f"https://t.me/{BOT_USERNAME}?start=welcome")]
+    ])
+    ACTIVATE_KEYBOARD = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📩 Activer le bot", url=f"https://t.me/{BOT_USERNAME}?start=start")]
+    ])
+
+    PUB_IMAGES = await asyncio.to_thread(charger_images_pubs)
+    logger.info("%d images de pubs indexées", sum(map(len, PUB_IMAGES.values())))
+
+    taches_planifiees.extend([
+        asyncio.create_task(at_daily(12, 0, None, envoyer_rappel_lundi_jeudi, application)),
+        asyncio.create_task(at_daily(12, 0, None, envoyer_rappel_mardi_vendredi_dimanche, application)),
+        asyncio.create_task(at_daily(12, 0, TZ_CAIRO, envoyer_pub_entreprise, application)),
+    ])
     logger.info("✅ Planificateur de messages périodiques démarré")
 
 #   Commandes admins
+async def _confirmer_ban_groupe(message, target_user, confirmation_msg):
+    """Envoie la confirmation du /ban dans le groupe"""
+    try:
+        group_message = await message.reply_text(confirmation_msg)
+        logger.info("✅ Confirmation envoyée dans le groupe (ID: %s)", group_message.message_id)
+        
+    except Exception as e:
+        logger.error("❌ Erreur envoi confirmation groupe: %s", e)
+        # Repli : message court, sans le motif ni les détails
+        try:
+            await message.reply_text(f"Ban effectué pour {target_user.first_name}")
+            logger.info("✅ Confirmation courte envoyée")
+        except Exception as e2:
+            logger.error("❌ Erreur envoi confirmation courte: %s", e2)
+
+# Utilisateurs qui ne peuvent pas recevoir de message privé du bot (bot bloqué,
+# conversation jamais ouverte). Oubliés au bout d'un jour : ils ont pu débloquer
+# le bot depuis
+_cannot_pm = TTLCache(maxsize=4096, ttl=24 * 3600)
+
+async def _notifier_ban_prive(context, target_user, private_message):
+    """Prévient l'utilisateur banni en privé ; renvoie False si c'est impossible"""
+    # Lecture seule : réécrire l'entrée repousserait son expiration
+    if target_user.id in _cannot_pm:
+        logger.info("Message privé à %s ignoré : impossible lors d'un ban récent", target_user.first_name)
+        return False
+
+    try:
+        await context.bot.send_message(
+            chat_id=target_user.id,
+            text=private_message,
+            parse_mode=ParseMode.HTML
+        )
+        
+        logger.info("✅ Message privé envoyé à %s", target_user.first_name)
+        return True
+        
+    except (BadRequest, Forbidden) as e:
+        # Une erreur de mise en forme (BadRequest) ne dit rien de l'utilisateur
+        if isinstance(e, Forbidden) or "chat not found" in str(e).lower():
+            _cannot_pm[target_user.id] = None
+        logger.warning("❌ Impossible d'envoyer un message privé à %s: %s", target_user.first_name, e)
+        return False
+
+# update_id des /ban déjà traités : un update redélivré par Telegram ne doit
+# pas bannir et notifier une seconde fois
+_processed_bans = TTLCache(maxsize=4096, ttl=3600)
+
 async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Gère la commande /ban pour les administrateurs"""
     
@@ -782,6 +1083,11 @@ async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     if not update.message:
         logger.warning("Commande /ban appelée sans message (probablement un événement chat_member)")
         return
+
+    if update.update_id in _processed_bans:
+        logger.info("ban_cmd update %s déjà traité, ignoré", update.update_id)
+        return
+    _processed_bans[update.update_id] = None
     
     user = update.effective_user
     chat = update.effective_chat
@@ -791,26 +1097,33 @@ async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await update.message.reply_text("❌ Cette commande ne peut être utilisée que dans un groupe.")
         return
     
+    reply = update.message.reply_to_message
+    target_user = reply.from_user if reply else None
+
+    # Vérifier en parallèle les droits de l'auteur et ceux de la cible
+    if target_user and target_user.id != user.id:
+        is_admin, target_is_admin = await asyncio.gather(
+            is_user_admin(context, chat.id, user.id),
+            is_user_admin(context, chat.id, target_user.id),
+        )
+    else:
+        is_admin, target_is_admin = await is_user_admin(context, chat.id, user.id), False
+
     # Vérifier si l'utilisateur est admin
-    if not await is_user_admin(context, chat.id, user.id):
-        await update.message.reply_text("❌ Vous n'avez pas les permissions d'administrateur.")
-        await asyncio.sleep(5)
-        await supprimer_message(update.message)
+    if not is_admin:
+        await _reply_ephemeral(update, context, "❌ Vous n'avez pas les permissions d'administrateur.", ttl=5)
         return
     
-    # DIAGNOSTIC DÉTAILLÉ
-    logger.info(f"=== DIAGNOSTIC BAN COMMAND ===")
-    logger.info(f"Message ID: {update.message.message_id}")
-    logger.info(f"Chat ID: {chat.id}")
-    logger.info(f"User ID: {user.id}")
-    logger.info(f"Message text: {update.message.text}")
-    logger.info(f"Reply to message: {update.message.reply_to_message}")
-    logger.info(f"Update object type: {type(update)}")
-    logger.info(f"Message object: {update.message}")
+    # Diagnostic : une seule ligne, le détail du message seulement en DEBUG
+    logger.info("ban_cmd msg=%s chat=%s user=%s reply=%s",
+                update.message.message_id, chat.id, user.id, reply is not None)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("ban_cmd texte=%r réponse à=%s", update.message.text, reply)
     
     # Vérifier si c'est une réponse à un message
-    if not update.message.reply_to_message:
-        await update.message.reply_text(
+    if not target_user:
+        await _reply_ephemeral(
+            update, context,
             "❌ **Comment utiliser la commande /ban :**\n\n"
             "1️⃣ Répondez au message de l'utilisateur à bannir\n"
             "2️⃣ Tapez `/ban [durée] [motif]`\n\n"
@@ -819,87 +1132,79 @@ async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             "• `/ban 7d violation des règles` (ban 7 jours)\n"
             "• `/ban permanent trolling` (ban définitif)\n\n"
             "⏱️ **Durées acceptées :** 30m, 2h, 7d, permanent",
+            ttl=10,
             parse_mode=ParseMode.MARKDOWN
         )
-        await asyncio.sleep(10)
-        await supprimer_message(update.message)
         return
     
-    target_user = update.message.reply_to_message.from_user
-    
     # Empêcher de se bannir soi-même
     if target_user.id == user.id:
-        await update.message.reply_text("❌ Vous ne pouvez pas vous bannir vous-même.")
-        await asyncio.sleep(5)
-        await supprimer_message(update.message)
+        await _reply_ephemeral(update, context, "❌ Vous ne pouvez pas vous bannir vous-même.", ttl=5)
         return
     
     # Vérifier si la cible n'est pas un admin
-    if await is_user_admin(context, chat.id, target_user.id):
-        await update.message.reply_text("❌ Vous ne pouvez pas bannir un autre administrateur.")
-        await asyncio.sleep(5)
-        await supprimer_message(update.message)
+    if target_is_admin:
+        await _reply_ephemeral(update, context, "❌ Vous ne pouvez pas bannir un autre administrateur.", ttl=5)
         return
     
     # Parser les arguments
-    args = context.args
-    duration_str = args[0] if args else "permanent"
-    motif = " ".join(args[1:]) if len(args) > 1 else "Aucun motif spécifié"
+    match context.args:
+        case []:
+            duration_str, motif = "permanent", "Aucun motif spécifié"
+        case [duration_str]:
+            motif = "Aucun motif spécifié"
+        case [duration_str, *mots]:
+            motif = " ".join(mots)
     
     # Parser la durée
     duration = parse_duration(duration_str)
     if duration is False:
-        await update.message.reply_text(
+        await _reply_ephemeral(
+            update, context,
             "❌ Format de durée invalide. Utilisez: 30m, 2h, 7d ou 'permanent'\n"
-            "Exemple: `/ban 1h Spam` ou `/ban permanent Violation des règles`"
+            "Exemple: `/ban 1h Spam` ou `/ban permanent Violation des règles`",
+            ttl=10
         )
-        await asyncio.sleep(10)
-        await supprimer_message(update.message)
         return
     
     # Calculer la date de fin si ce n'est pas permanent
-    timezone_egypt = pytz.timezone('Africa/Cairo')
-    until_date = datetime.now(timezone_egypt) + duration if duration else None
+    until_date = datetime.now(TZ_CAIRO) + duration if duration else None
     
     # Variables pour le rapport
     ban_success = False
     ban_error = None
+    not_participant = False
     
     try:
-        # Bannir l'utilisateur
-        if until_date:
-            await context.bot.ban_chat_member(
-                chat_id=chat.id,
-                user_id=target_user.id,
-                until_date=until_date
-            )
-        else:
-            await context.bot.ban_chat_member(
-                chat_id=chat.id,
-                user_id=target_user.id
-            )
+        # Bannir l'utilisateur (until_date à None : ban définitif)
+        await context.bot.ban_chat_member(
+            chat_id=chat.id,
+            user_id=target_user.id,
+            until_date=until_date
+        )
         
         ban_success = True
-        logger.info(f"✅ {target_user.first_name} banni par {user.first_name} - Motif: {motif}")
+        logger.info("✅ %s banni par %s - Motif: %s", target_user.first_name, user.first_name, motif)
         
     except BadRequest as e:
         ban_error = e
+        not_participant = "user_not_participant" in str(e).lower()
         # Log mais continue le traitement pour informer
-        if "user_not_participant" in str(e).lower():
-            logger.warning(f"⚠️ {target_user.first_name} déjà absent du groupe - tentative de bannissement préventif")
+        if not_participant:
+            logger.warning("⚠️ %s déjà absent du groupe - tentative de bannissement préventif", target_user.first_name)
             # Essayer un bannissement préventif
             try:
                 await context.bot.ban_chat_member(chat_id=chat.id, user_id=target_user.id)
                 ban_success = True
                 logger.info("✅ Bannissement préventif réussi")
-            except:
-                logger.error("❌ Bannissement préventif échoué")
+            except TelegramError as e2:
+                logger.error("❌ Bannissement préventif échoué: %s", e2)
         else:
-            logger.error(f"❌ Erreur ban: {e}")
+            logger.error("❌ Erreur ban: %s", e)
     
     except Exception as e:
         ban_error = e
-        logger.error(f"❌ Erreur inattendue lors du ban: {e}")
+        logger.error("❌ Erreur inattendue lors du ban: %s", e)
     
     # TOUJOURS envoyer les messages informatifs, même si le ban a échoué
     ban_type = format_duration(duration)
@@ -914,7 +1219,7 @@ async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         )
         status_icon = "✅"
     else:
-        if ban_error and "user_not_participant" in str(ban_error).lower():
+        if not_participant:
             confirmation_msg = (
                 f"⚠️ Tentative de bannissement\n\n"
                 f"📊 Statut: Utilisateur déjà absent du groupe\n"
@@ -932,89 +1237,91 @@ async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
                 f"⚠️ Erreur: {ban_error}"
             )
     
-    # Envoyer le message de confirmation dans le groupe
-    try:
-        # Test simple d'abord
-        simple_msg = f"✅ un membre a été traité par {user.first_name}"
-        group_message = await update.message.reply_text(simple_msg)
-        logger.info(f"✅ Message simple envoyé dans le groupe (ID: {group_message.message_id})")
-        
-        # Puis le message détaillé
-        await asyncio.sleep(1)  # Petit délai
-        group_message2 = await update.message.reply_text(confirmation_msg)
-        logger.info(f"✅ Message détaillé envoyé dans le groupe (ID: {group_message2.message_id})")
-        
-    except Exception as e:
-        logger.error(f"❌ Erreur envoi confirmation groupe: {e}")
-        # Essayer sans markdown en cas de problème de formatage
-        try:
-            await update.message.reply_text(f"Test: Ban effectué pour {target_user.first_name}")
-            logger.info("✅ Message de test envoyé sans formatage")
-        except Exception as e2:
-            logger.error(f"❌ Erreur envoi test: {e2}")
-    
-    # Envoyer un message privé à l'utilisateur (même si le ban a échoué)
-    try:
-        if ban_success:
-            private_message = (
-                f"🚫 **Vous avez été banni du groupe {chat.title}**\n\n"
-                f"⏱️ **Durée:** {ban_type}\n"
-                f"📋 **Motif:** {motif}\n\n"
-            )
-            
-            if duration:
-                end_time = until_date.strftime("%d/%m/%Y à %H:%M")
-                private_message += f"🕒 **Fin du ban:** {end_time}\n\n"
-            
-            private_message += "ℹ️ Si vous pensez que ce bannissement est injustifié, contactez les administrateurs."
-        else:
-            private_message = (
-                f"⚠️ **Information du groupe {chat.title}**\n\n"
-                f"Un administrateur ({user.first_name}) a tenté de vous bannir.\n"
-                f"📋 **Motif:** {motif}\n\n"
-                f"💡 Vous n'étiez déjà plus membre du groupe."
-            )
-        
-        await context.bot.send_message(
-            chat_id=target_user.id,
-            text=private_message,
-            parse_mode=ParseMode.MARKDOWN
+    # Message privé à l'utilisateur (même si le ban a échoué), en HTML : le titre,
+    # le motif et le prénom sont échappés et ne peuvent pas casser la mise en forme
+    titre_html = html.escape(chat.title or "")
+    motif_html = html.escape(motif)
+    if ban_success:
+        fin_ban = f"🕒 <b>Fin du ban:</b> {until_date:%d/%m/%Y à %H:%M}\n\n" if duration else ""
+        private_message = (
+            f"🚫 <b>Vous avez été banni du groupe {titre_html}</b>\n\n"
+            f"⏱️ <b>Durée:</b> {ban_type}\n"
+            f"📋 <b>Motif:</b> {motif_html}\n\n"
+            f"{fin_ban}"
+            "ℹ️ Si vous pensez que ce bannissement est injustifié, contactez les administrateurs."
         )
-        
-        logger.info(f"✅ Message privé envoyé à {target_user.first_name}")
-        
-    except (BadRequest, Forbidden) as e:
-        logger.warning(f"❌ Impossible d'envoyer un message privé à {target_user.first_name}: {e}")
+    else:
+        private_message = (
+            f"⚠️ <b>Information du groupe {titre_html}</b>\n\n"
+            f"Un administrateur ({html.escape(user.first_name)}) a tenté de vous bannir.\n"
+            f"📋 <b>Motif:</b> {motif_html}\n\n"
+            f"💡 Vous n'étiez déjà plus membre du groupe."
+        )
+
+    # Confirmation dans le groupe et message privé partent en parallèle ; l'avis
+    # d'échec du message privé n'est posté qu'après la confirmation
+    _, pm_envoye = await asyncio.gather(
+        _confirmer_ban_groupe(update.message, target_user, confirmation_msg),
+        _notifier_ban_prive(context, target_user, private_message),
+    )
+    if not pm_envoye:
         await update.message.reply_text(
             "⚠️ L'utilisateur n'a pas pu être notifié en privé (bot bloqué ou paramètres de confidentialité)."
         )
     
     # Supprimer le message de commande après un délai
-    await asyncio.sleep(10)
-    await supprimer_message(update.message)
+    context.job_queue.run_once(_delete_later, 10, data=update.message)
+
+
+# Table des commandes : un seul handler PTB, puis recherche dans ce dictionnaire
+COMMANDS = {
+    **{cmd: generic_info_command for cmd in COMMAND_MAPPINGS},
+    **{savant_id: savant_command_handler for savant_id in SAVANTS_INFO},
+    'reload': reload_messages,
+    'reload_images': reload_images,
+    'start': start,
+    'getid': get_chat_id,
+    'help': help_command,
+    'ban': ban_command,
+}
+
+async def dispatch_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Aiguille une commande vers son gestionnaire (unknown_command par défaut)"""
+    mots = update.message.text.split()
+    commande, _, destinataire = mots[0][1:].partition('@')
+
+    # /commande@autre_bot ne nous est pas adressée
+    if destinataire and destinataire.lower() != BOT_USERNAME.lower():
+        return
+
+    # Comme CommandHandler : les arguments sont les mots qui suivent la commande
+    context.args = mots[1:]
+    await COMMANDS.get(commande.lower(), unknown_command)(update, context)
 
 
 if __name__ == '__main__':
-    setup_signal_handlers()
     logger.info("=== Démarrage de l'application R2D2 ===")
 
     # Configure d'abord le bot
     setup_telegram_bot()
-    
-    # Puis démarre le bot
-    bot_thread = start_telegram_bot_thread()
 
-    # Flask
-    port = int(os.environ.get('PORT', 5000))
-    logger.info(f"Démarrage du serveur Flask sur le port {port}")
-    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
+    if sys.argv[1:2] == ['bot']:
+        # Worker seul (render.yaml) : pas de serveur HTTP, run_polling installe
+        # lui-même les handlers SIGINT/SIGTERM
+        if not telegram_app:
+            logger.error("Impossible de démarrer le bot : telegram_app est None")
+            sys.exit(1)
+        telegram_app.run_polling(**POLLING_OPTIONS)
+    else:
+        # Bot et Flask partagent la même boucle asyncio
+        port = int(os.environ.get('PORT', 5000))
+        logger.info("Démarrage du serveur HTTP sur le port %s", port)
+        asyncio.run(run_bot_and_web(port))
 else:
-    setup_signal_handlers()
     logger.info("=== Démarrage en mode production ===")
 
-    # Configure et démarre aussi en prod
-    setup_telegram_bot()
-    bot_thread = start_telegram_bot_thread()
+    # Le bot est configuré et démarré par gunicorn dans post_fork
+    # (avec preload_app, un thread lancé ici resterait dans le master)
 
 
 